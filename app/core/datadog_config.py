@@ -1,20 +1,86 @@
+import asyncio
+import functools
 import os
-from datadog import initialize, statsd
-from ddtrace import tracer
-import psutil
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Seconds between background refreshes of the system metrics snapshot
+SYSTEM_METRICS_SAMPLE_INTERVAL = 5.0
+
+# Seconds between flushes of the system metric gauges to Datadog
+SYSTEM_METRICS_FLUSH_INTERVAL = 10.0
+
+# Maximum number of metrics held in the queue before new ones are dropped
+METRICS_QUEUE_MAXSIZE = 100_000
+
+# Maximum number of queued metrics sent to DogStatsd in one batch
+METRICS_MAX_BATCH = 512
+
+# Seconds the queue consumer waits for a batch to fill before sending it
+METRICS_FLUSH_INTERVAL = 0.1
+
+# Bytes to megabytes
+_MB = 1.0 / (1024 * 1024)
+
+# Latest system metrics snapshot, refreshed by the background sampler
+_system_metrics_cache = {
+    'cpu_percent': 0.0,
+    'memory_percent': 0.0,
+    'memory_available_mb': 0.0,
+}
+
+
 class DatadogMetrics:
     """Datadog metrics client for tracking application metrics."""
     
     def __init__(self):
         self.initialized = False
+        self.statsd = None
+        # Created by start() so it binds to the event loop that serves the app
+        self._queue = None
+        # Metrics shed because the queue was full (e.g. the agent is unreachable)
+        self.dropped_metrics = 0
+        # Metrics DogStatsd raised on while sending a batch
+        self.failed_metrics = 0
+        # Client-side sample rate for high-volume request metrics
+        self.sample_rate = self._load_sample_rate()
         self._initialize_datadog()
     
+    def _load_sample_rate(self) -> float:
+        """Read DD_SAMPLE_RATE, falling back to 1.0 if it is invalid or out of (0, 1]."""
+        raw = os.getenv('DD_SAMPLE_RATE', '1.0')
+        try:
+            sample_rate = float(raw)
+            if not 0.0 < sample_rate <= 1.0:
+                raise ValueError("must be in (0, 1]")
+        except ValueError as e:
+            logger.warning(f"Invalid DD_SAMPLE_RATE {raw!r} ({e}), using 1.0")
+            return 1.0
+        return sample_rate
+    
+    def _load_so_sndbuf(self, default: int) -> int:
+        """Read DD_DOGSTATSD_SO_SNDBUF, falling back to default if it is invalid or negative."""
+        raw = os.getenv('DD_DOGSTATSD_SO_SNDBUF')
+        if raw is None:
+            return default
+        try:
+            so_sndbuf = int(raw)
+            if so_sndbuf < 0:
+                raise ValueError("must not be negative")
+        except ValueError as e:
+            logger.warning(f"Invalid DD_DOGSTATSD_SO_SNDBUF {raw!r} ({e}), using {default}")
+            return default
+        return so_sndbuf
+    
     def _initialize_datadog(self):
         """Initialize Datadog client with configuration from environment."""
+        from datadog import initialize
+        from app.core.statsd_client import STATSD_SO_SNDBUF, TunedDogStatsd
+        
+        # Prime psutil's CPU counter so later non-blocking readings are meaningful
+        self.refresh_system_metrics()
+        
         try:
             api_key = os.getenv('DD_API_KEY')
             if not api_key:
@@ -27,52 +93,154 @@ class DatadogMetrics:
                 'app_key': os.getenv('DD_APP_KEY', ''),
             }
             
+            # Batches are buffered per send in _send_batch, so no client-side flush thread
+            statsd_options = {
+                'so_sndbuf': self._load_so_sndbuf(STATSD_SO_SNDBUF),
+            }
+            
             # Only configure statsd if agent is available
             statsd_host = os.getenv('DD_AGENT_HOST', 'localhost')
             statsd_port = int(os.getenv('DD_DOGSTATSD_PORT', 8125))
+            # Unix domain socket exposed by a co-located agent (dogstatsd_socket)
+            statsd_socket = os.getenv('DD_DOGSTATSD_SOCKET')
             
             # Check if running in agentless mode
             if os.getenv('DD_AGENTLESS_MODE', 'false').lower() == 'true':
                 logger.info("Running in agentless mode - using direct API submission")
                 options['statsd_host'] = None
+            elif statsd_socket:
+                logger.info(f"Sending DogStatsD metrics over UDS at {statsd_socket}")
+                options['statsd_socket_path'] = statsd_socket
+                statsd_options['socket_path'] = statsd_socket
             else:
                 options['statsd_host'] = statsd_host
                 options['statsd_port'] = statsd_port
+                statsd_options['host'] = statsd_host
+                statsd_options['port'] = statsd_port
             
             initialize(**options)
+            self.statsd = TunedDogStatsd(**statsd_options)
             self.initialized = True
             logger.info("Datadog metrics initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize Datadog: {e}")
             self.initialized = False
     
-    def increment_counter(self, metric_name: str, value: int = 1, tags: list = None):
+    def _enqueue(self, item: tuple):
+        """Queue a metric for the consumer, dropping it if the queue is full."""
+        queue = self._queue
+        # Outside the app lifespan there is no consumer to send it
+        if queue is None:
+            return
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped_metrics += 1
+    
+    def increment_counter(self, metric_name: str, value: int = 1, tags: list = None,
+                          sample_rate: float = 1.0):
         """Increment a counter metric."""
         if self.initialized:
-            statsd.increment(metric_name, value=value, tags=tags or [])
+            self._enqueue(('increment', metric_name, value, tags, sample_rate))
     
     def record_gauge(self, metric_name: str, value: float, tags: list = None):
         """Record a gauge metric."""
         if self.initialized:
-            statsd.gauge(metric_name, value, tags=tags or [])
+            self._enqueue(('gauge', metric_name, value, tags, 1.0))
     
-    def record_histogram(self, metric_name: str, value: float, tags: list = None):
+    def record_histogram(self, metric_name: str, value: float, tags: list = None,
+                         sample_rate: float = None):
         """Record a histogram metric (for distributions like response times)."""
         if self.initialized:
-            statsd.histogram(metric_name, value, tags=tags or [])
+            if sample_rate is None:
+                sample_rate = self.sample_rate
+            self._enqueue(('histogram', metric_name, value, tags, sample_rate))
     
-    def record_timing(self, metric_name: str, value: float, tags: list = None):
+    def record_timing(self, metric_name: str, value: float, tags: list = None,
+                      sample_rate: float = None):
         """Record a timing metric in milliseconds."""
         if self.initialized:
-            statsd.timing(metric_name, value, tags=tags or [])
+            if sample_rate is None:
+                sample_rate = self.sample_rate
+            self._enqueue(('timing', metric_name, value, tags, sample_rate))
+    
+    def _send_batch(self, batch: list):
+        """Send a batch of queued metrics through one DogStatsd buffer."""
+        statsd = self.statsd
+        failed = 0
+        last_error = None
+        try:
+            with statsd:
+                for kind, metric_name, value, tags, sample_rate in batch:
+                    # One bad metric must not cost the rest of the batch
+                    try:
+                        getattr(statsd, kind)(
+                            metric_name, value, tags=tags or [], sample_rate=sample_rate
+                        )
+                    except Exception as e:
+                        failed += 1
+                        last_error = e
+        except Exception as e:
+            logger.error(f"Error sending metrics batch: {e}")
+        if failed:
+            self.failed_metrics += failed
+            logger.error(f"Failed to send {failed} of {len(batch)} metrics in batch: {last_error}")
+    
+    def start(self) -> asyncio.Task:
+        """Create the metrics queue on the running loop and start its consumer."""
+        self._queue = asyncio.Queue(maxsize=METRICS_QUEUE_MAXSIZE)
+        return asyncio.create_task(self.run_metrics_consumer())
+    
+    async def run_metrics_consumer(self):
+        """Drain queued metrics and send them to Datadog in batches."""
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            try:
+                # Give the batch a chance to fill unless enough is already waiting
+                if queue.qsize() < METRICS_MAX_BATCH - 1:
+                    await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+            finally:
+                # Send what we hold even when cancelled mid-wait at shutdown
+                while len(batch) < METRICS_MAX_BATCH and not queue.empty():
+                    batch.append(queue.get_nowait())
+                self._send_batch(batch)
+    
+    def flush(self):
+        """Send all queued metrics."""
+        queue = self._queue
+        if not self.initialized or queue is None:
+            return
+        
+        batch = []
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        if batch:
+            self._send_batch(batch)
+    
+    def close(self):
+        """Flush all metrics, then stop the DogStatsd client and close its socket."""
+        if not self.initialized:
+            return
+        
+        self.flush()
+        self._queue = None
+        self.statsd.stop()
+    
+    def refresh_system_metrics(self):
+        """Sample system metrics (CPU, memory) into the cached snapshot."""
+        import psutil
+        
+        vm = psutil.virtual_memory()
+        _system_metrics_cache.update({
+            'cpu_percent': psutil.cpu_percent(interval=None),
+            'memory_percent': vm.percent,
+            'memory_available_mb': vm.available * _MB
+        })
     
     def get_system_metrics(self):
-        """Get current system metrics (CPU, memory)."""
-        return {
-            'cpu_percent': psutil.cpu_percent(interval=1),
-            'memory_percent': psutil.virtual_memory().percent,
-            'memory_available_mb': psutil.virtual_memory().available / (1024 * 1024)
-        }
+        """Get the latest cached system metrics (CPU, memory)."""
+        return dict(_system_metrics_cache)
     
     def track_system_metrics(self):
         """Track and send system metrics to Datadog."""
@@ -88,5 +256,7 @@ class DatadogMetrics:
             logger.error(f"Error tracking system metrics: {e}")
 
 
-# Global instance
-datadog_metrics = DatadogMetrics()
+@functools.lru_cache(maxsize=1)
+def get_datadog_metrics() -> DatadogMetrics:
+    """Return the shared Datadog metrics client, creating it on first use."""
+    return DatadogMetrics()
@@ -0,0 +1,21 @@
+import orjson
+from fastapi.responses import JSONResponse
+
+
+class SafeORJSONResponse(JSONResponse):
+    """JSON response rendered with orjson, falling back to stdlib json.
+    
+    Renders with orjson directly rather than subclassing FastAPI's
+    ORJSONResponse, which newer FastAPI releases deprecate. Routes here return
+    plain dicts without a response model, so they still go through the
+    response class and orjson remains the faster path.
+    
+    orjson refuses integers wider than 64 bits, which client-supplied or
+    upstream JSON can legitimately contain; those fall back to stdlib json.
+    """
+    
+    def render(self, content) -> bytes:
+        try:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        except orjson.JSONEncodeError:
+            return super().render(content)
@@ -0,0 +1,33 @@
+import socket
+from datadog import DogStatsd
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Default kernel send buffer (bytes) requested for the DogStatsD socket
+STATSD_SO_SNDBUF = 25 * 1024 * 1024
+
+
+class TunedDogStatsd(DogStatsd):
+    """DogStatsd client that enlarges the kernel send buffer of its socket."""
+    
+    def __init__(self, *args, so_sndbuf: int = STATSD_SO_SNDBUF, **kwargs):
+        if so_sndbuf < 0:
+            # setsockopt reads the size as unsigned, so a negative one asks for the maximum
+            logger.warning(f"Ignoring negative so_sndbuf {so_sndbuf}, using {STATSD_SO_SNDBUF}")
+            so_sndbuf = STATSD_SO_SNDBUF
+        self.so_sndbuf = so_sndbuf
+        self._tuned_socket = None
+        super().__init__(*args, **kwargs)
+    
+    def get_socket(self, *args, **kwargs):
+        """Return the connected socket, tuning SO_SNDBUF whenever it is (re)created."""
+        sock = super().get_socket(*args, **kwargs)
+        if sock is not None and sock is not self._tuned_socket:
+            self._tuned_socket = sock
+            if self.so_sndbuf:
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.so_sndbuf)
+                except OSError as e:
+                    logger.warning(f"Could not set SO_SNDBUF on DogStatsD socket: {e}")
+        return sock
@@ -1,24 +1,63 @@
+import asyncio
+import functools
+import itertools
 import os
+import sys
 import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 # Load environment variables FIRST before other imports
 load_dotenv()
 
+import orjson
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 import logging
-from app.core.datadog_config import datadog_metrics
+from app.core.datadog_config import (
+    get_datadog_metrics,
+    SYSTEM_METRICS_FLUSH_INTERVAL,
+    SYSTEM_METRICS_SAMPLE_INTERVAL,
+)
+from app.core.responses import SafeORJSONResponse
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run background metrics tasks for the lifetime of the service."""
+    datadog_metrics = get_datadog_metrics()
+    logger.info("Nexus Analytics service starting up")
+    background_tasks = [
+        asyncio.create_task(_system_metrics_sampler()),
+        asyncio.create_task(_system_metrics_loop()),
+        datadog_metrics.start(),
+    ]
+    datadog_metrics.increment_counter('nexus.analytics.service.startup')
+    
+    try:
+        yield
+    finally:
+        logger.info("Nexus Analytics service shutting down")
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        
+        # Drain queued metrics so nothing is dropped, then release the client
+        datadog_metrics.increment_counter('nexus.analytics.service.shutdown')
+        datadog_metrics.close()
+
+
 app = FastAPI(
     title="Nexus Analytics",
     version="0.1.0",
-    description="Analytics microservice with Datadog monitoring"
+    description="Analytics microservice with Datadog monitoring",
+    default_response_class=SafeORJSONResponse,
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -26,119 +65,208 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://localhost:3001"],  # React dev server
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization"],
 )
 
 # Datadog APM environment variables
 os.environ.setdefault('DD_SERVICE', os.getenv('DD_SERVICE', 'nexus-analytics'))
-os.environ.setdefault('DD_ENV', os.getenv('DD_ENV', 'production'))
+# DogStatsd also tags metrics with DD_ENV, so only default it under ddtrace-run
+# (which imports ddtrace first) to keep dev traffic off production dashboards
+if 'ddtrace' in sys.modules:
+    os.environ.setdefault('DD_ENV', os.getenv('DD_ENV', 'production'))
 os.environ.setdefault('DD_LOGS_INJECTION', 'true')
 
-# Analytics query counter (in-memory for demo)
-analytics_query_count = 0
+# Analytics query counter (in-memory for demo); next() on itertools.count is atomic
+_query_counter = itertools.count(1)
+_last_query_id = 0
+
+# Liveness/probe paths that skip per-request metrics in the middleware
+_PROBE_PATHS = frozenset({'/health', '/'})
+
+# Constant response bodies, serialized once at import
+ROOT_BODY = orjson.dumps({"message": "Welcome to Nexus Analytics Service"})
+HEALTH_BODY = orjson.dumps({"status": "healthy", "service": "nexus-analytics"})
+
+# Monotonic clock for latency measurements
+_perf = time.perf_counter
+
+# Pre-formatted metric tags, so the request path doesn't rebuild them per hit
+_METHOD_TAG = {
+    method: f'method:{method}'
+    for method in ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'OTHER')
+}
+
+# Route template reported for requests that matched no route
+_UNMATCHED_ROUTE = 'unmatched'
+
+# Tag lists per (method, route template), built lazily and shared across requests.
+# Kept as lists because DogStatsd concatenates them with its constant tags.
+_ROUTE_TAGS = {}
+
+# Tag lists per (method, route template, status code), built lazily
+_ROUTE_STATUS_TAGS = {}
+
+
+def _route_template(request: Request) -> str:
+    """Return the matched route template (e.g. /items/{id}) for a request."""
+    route = request.scope.get('route')
+    return route.path if route is not None else _UNMATCHED_ROUTE
+
+
+def _normalize_method(method: str) -> str:
+    """Map unknown HTTP methods to OTHER so they can't grow the tag caches."""
+    return method if method in _METHOD_TAG else 'OTHER'
+
+
+def _route_tags(method: str, template: str) -> list:
+    """Return the shared method/path tag list for a route."""
+    method = _normalize_method(method)
+    key = (method, template)
+    tags = _ROUTE_TAGS.get(key)
+    if tags is None:
+        tags = _ROUTE_TAGS[key] = [_METHOD_TAG[method], f'path:{template}']
+    return tags
+
+
+def _route_status_tags(method: str, template: str, status_code: int) -> list:
+    """Return the shared method/path/status tag list for a route response."""
+    method = _normalize_method(method)
+    key = (method, template, status_code)
+    tags = _ROUTE_STATUS_TAGS.get(key)
+    if tags is None:
+        tags = _ROUTE_STATUS_TAGS[key] = _route_tags(method, template) + [_status_tag(status_code)]
+    return tags
+
+
+@functools.lru_cache(maxsize=512)
+def _status_tag(status_code: int) -> str:
+    """Return the metric tag for an HTTP status code."""
+    return f'status:{status_code}'
+
+
+async def _system_metrics_sampler():
+    """Refresh the cached system metrics snapshot off the request path."""
+    datadog_metrics = get_datadog_metrics()
+    while True:
+        await asyncio.sleep(SYSTEM_METRICS_SAMPLE_INTERVAL)
+        try:
+            datadog_metrics.refresh_system_metrics()
+        except Exception as e:
+            logger.error(f"Error sampling system metrics: {e}")
+
+
+async def _system_metrics_loop():
+    """Flush system and running-total gauges to Datadog at a fixed cadence."""
+    datadog_metrics = get_datadog_metrics()
+    last_sent_total = None
+    while True:
+        await asyncio.sleep(SYSTEM_METRICS_FLUSH_INTERVAL)
+        datadog_metrics.track_system_metrics()
+        
+        # Track total queries as gauge, only when it has changed
+        queries_total = _last_query_id
+        if queries_total != last_sent_total:
+            datadog_metrics.record_gauge('nexus.analytics.queries.total', queries_total)
+            last_sent_total = queries_total
 
 
 @app.middleware("http")
 async def datadog_middleware(request: Request, call_next):
     """Middleware to track request metrics in Datadog."""
-    start_time = time.time()
+    # Probe traffic is high-volume and uninteresting, pass it straight through
+    if request.url.path in _PROBE_PATHS:
+        return await call_next(request)
     
-    # Increment request counter
-    datadog_metrics.increment_counter(
-        'nexus.analytics.request.count',
-        tags=[f'method:{request.method}', f'path:{request.url.path}']
-    )
-    
-    # Track system metrics periodically
-    datadog_metrics.track_system_metrics()
+    datadog_metrics = get_datadog_metrics()
+    start_time = _perf()
+    # Skip all tag building when Datadog is disabled
+    metrics_enabled = datadog_metrics.initialized
     
     try:
         response = await call_next(request)
-        
+    except Exception as e:
+        if metrics_enabled:
+            request_tags = _route_tags(request.method, _route_template(request))
+            
+            # Increment request counter
+            datadog_metrics.increment_counter(
+                'nexus.analytics.request.count',
+                tags=request_tags,
+                sample_rate=datadog_metrics.sample_rate
+            )
+            
+            # Track errors
+            datadog_metrics.increment_counter(
+                'nexus.analytics.request.error',
+                tags=request_tags + [f'error_type:{type(e).__name__}']
+            )
+        logger.error(f"Request error: {e}", exc_info=True)
+        raise
+    
+    if metrics_enabled:
         # Calculate response time
-        response_time = (time.time() - start_time) * 1000  # Convert to ms
+        response_time = (_perf() - start_time) * 1000.0  # Convert to ms
+        
+        # Route template is only known once the router has matched the request
+        method = request.method
+        template = _route_template(request)
+        status_code = response.status_code
+        request_tags = _route_tags(method, template)
+        
+        # Increment request counter
+        datadog_metrics.increment_counter(
+            'nexus.analytics.request.count',
+            tags=request_tags,
+            sample_rate=datadog_metrics.sample_rate
+        )
         
         # Track response time
         datadog_metrics.record_histogram(
             'nexus.analytics.request.duration',
             response_time,
-            tags=[
-                f'method:{request.method}',
-                f'path:{request.url.path}',
-                f'status:{response.status_code}'
-            ]
+            tags=_route_status_tags(method, template, status_code)
         )
         
         # Track successful requests
-        if 200 <= response.status_code < 300:
+        if 200 <= status_code < 300:
             datadog_metrics.increment_counter(
                 'nexus.analytics.request.success',
-                tags=[f'method:{request.method}', f'path:{request.url.path}']
+                tags=request_tags,
+                sample_rate=datadog_metrics.sample_rate
             )
-        
-        return response
-        
-    except Exception as e:
-        # Track errors
-        datadog_metrics.increment_counter(
-            'nexus.analytics.request.error',
-            tags=[
-                f'method:{request.method}',
-                f'path:{request.url.path}',
-                f'error_type:{type(e).__name__}'
-            ]
-        )
-        logger.error(f"Request error: {e}", exc_info=True)
-        raise
+    
+    return response
 
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     """Custom exception handler to track HTTP errors."""
-    datadog_metrics.increment_counter(
-        'nexus.analytics.http.error',
-        tags=[f'status:{exc.status_code}', f'path:{request.url.path}']
-    )
-    return JSONResponse(
+    datadog_metrics = get_datadog_metrics()
+    if datadog_metrics.initialized:
+        datadog_metrics.increment_counter(
+            'nexus.analytics.http.error',
+            tags=[_status_tag(exc.status_code), f'path:{_route_template(request)}']
+        )
+    return SafeORJSONResponse(
         status_code=exc.status_code,
         content={"detail": exc.detail}
     )
 
 
-@app.on_event("startup")
-async def startup_event():
-    """Log startup and track service start metric."""
-    logger.info("Nexus Analytics service starting up")
-    datadog_metrics.increment_counter('nexus.analytics.service.startup')
-
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Log shutdown and track service stop metric."""
-    logger.info("Nexus Analytics service shutting down")
-    datadog_metrics.increment_counter('nexus.analytics.service.shutdown')
-
-
 @app.get("/")
 async def root():
     """Root endpoint."""
-    return {"message": "Welcome to Nexus Analytics Service"}
+    return Response(content=ROOT_BODY, media_type="application/json")
 
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint with system metrics."""
-    system_metrics = datadog_metrics.get_system_metrics()
-    
+    """Liveness check endpoint."""
     # Track health check
-    datadog_metrics.increment_counter('nexus.analytics.health_check')
+    get_datadog_metrics().increment_counter('nexus.analytics.health_check')
     
-    return {
-        "status": "healthy",
-        "service": "nexus-analytics",
-        "system_metrics": system_metrics
-    }
+    return Response(content=HEALTH_BODY, media_type="application/json")
 
 
 @app.post("/analytics/query")
@@ -152,11 +280,13 @@ async def process_analytics_query(query: dict):
         "parameters": {...}
     }
     """
-    global analytics_query_count
+    global _last_query_id
+    datadog_metrics = get_datadog_metrics()
     
     try:
         # Increment business metric
-        analytics_query_count += 1
+        query_id = next(_query_counter)
+        _last_query_id = query_id
         
         # Track custom business metric
         datadog_metrics.increment_counter(
@@ -164,22 +294,16 @@ async def process_analytics_query(query: dict):
             tags=[f'query_type:{query.get("query_type", "unknown")}']
         )
         
-        # Track total queries as gauge
-        datadog_metrics.record_gauge(
-            'nexus.analytics.queries.total',
-            analytics_query_count
-        )
-        
         # Simulate query processing
-        processing_start = time.time()
+        processing_start = _perf()
         # Your actual analytics logic would go here
         result = {
-            "query_id": f"query_{analytics_query_count}",
+            "query_id": f"query_{query_id}",
             "query_type": query.get("query_type"),
             "status": "processed",
             "result": {"sample_data": [1, 2, 3, 4, 5]}
         }
-        processing_time = (time.time() - processing_start) * 1000
+        processing_time = (_perf() - processing_start) * 1000.0
         
         # Track query processing time
         datadog_metrics.record_timing(
@@ -203,15 +327,24 @@ async def process_analytics_query(query: dict):
 @app.get("/metrics/summary")
 async def metrics_summary():
     """Get a summary of current metrics."""
+    datadog_metrics = get_datadog_metrics()
     system_metrics = datadog_metrics.get_system_metrics()
     
     return {
-        "analytics_queries_processed": analytics_query_count,
+        "analytics_queries_processed": _last_query_id,
         "system_metrics": system_metrics,
-        "datadog_initialized": datadog_metrics.initialized
+        "datadog_initialized": datadog_metrics.initialized,
+        "dropped_metrics": datadog_metrics.dropped_metrics,
+        "failed_metrics": datadog_metrics.failed_metrics
     }
 
 
+@app.get("/metrics/system")
+async def system_metrics():
+    """Get the latest sampled system metrics (CPU, memory)."""
+    return get_datadog_metrics().get_system_metrics()
+
+
 @app.get("/metrics/transformer")
 async def get_transformer_metrics():
     """Fetch metrics from the Text-to-Image Transformer service."""
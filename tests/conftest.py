@@ -0,0 +1,14 @@
+import pytest
+
+from app.core.datadog_config import DatadogMetrics, get_datadog_metrics
+
+
+@pytest.fixture
+def sent_metrics(monkeypatch):
+    """Enable Datadog with a fresh client and capture batches instead of sending them."""
+    monkeypatch.setenv('DD_API_KEY', 'test')
+    sent = []
+    monkeypatch.setattr(DatadogMetrics, '_send_batch', lambda self, batch: sent.extend(batch))
+    get_datadog_metrics.cache_clear()
+    yield sent
+    get_datadog_metrics.cache_clear()
@@ -0,0 +1,30 @@
+import asyncio
+
+from app.core.datadog_config import DatadogMetrics
+
+
+def _enabled_metrics(monkeypatch) -> DatadogMetrics:
+    """Return a client that queues metrics without a real Datadog connection."""
+    monkeypatch.delenv('DD_API_KEY', raising=False)
+    metrics = DatadogMetrics()
+    metrics.initialized = True
+    return metrics
+
+
+def test_full_queue_drops_and_counts_metrics(monkeypatch):
+    metrics = _enabled_metrics(monkeypatch)
+    metrics._queue = asyncio.Queue(maxsize=2)
+    
+    for _ in range(5):
+        metrics.increment_counter('nexus.analytics.test')
+    
+    assert metrics._queue.qsize() == 2
+    assert metrics.dropped_metrics == 3
+
+
+def test_metrics_before_start_are_not_counted_as_dropped(monkeypatch):
+    metrics = _enabled_metrics(monkeypatch)
+    
+    metrics.increment_counter('nexus.analytics.test')
+    
+    assert metrics.dropped_metrics == 0
@@ -0,0 +1,35 @@
+import time
+
+from fastapi.testclient import TestClient
+
+from app.core.datadog_config import get_datadog_metrics
+from app.main import app
+
+
+def _sent_names(sent_metrics) -> list:
+    return [metric_name for _, metric_name, *_ in sent_metrics]
+
+
+def _wait_for_metric(sent_metrics, metric_name: str, timeout: float = 2.0) -> bool:
+    """Wait for the running queue consumer to send a metric."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if metric_name in _sent_names(sent_metrics):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_metrics_flow_across_repeated_lifespans(sent_metrics):
+    # Each TestClient block runs the lifespan on a new event loop
+    for _ in range(2):
+        sent_metrics.clear()
+        with TestClient(app) as client:
+            # Let the consumer go idle on an empty queue before the request
+            assert _wait_for_metric(sent_metrics, 'nexus.analytics.service.startup')
+            assert client.get('/metrics/summary').status_code == 200
+            assert _wait_for_metric(sent_metrics, 'nexus.analytics.request.count')
+        
+        # Shutdown drains the queue, so its own metric is sent last
+        assert _sent_names(sent_metrics)[-1] == 'nexus.analytics.service.shutdown'
+        assert get_datadog_metrics()._queue is None
@@ -0,0 +1,19 @@
+from fastapi.testclient import TestClient
+
+from app.core.responses import SafeORJSONResponse
+from app.main import app
+
+# Wider than orjson's 64-bit integer limit
+BIG_INT = 123456789012345678901234567890
+
+
+def test_safe_orjson_response_falls_back_for_wide_integers():
+    response = SafeORJSONResponse({"value": BIG_INT})
+    assert response.body == b'{"value":123456789012345678901234567890}'
+
+
+def test_analytics_query_echoes_wide_integer_query_type():
+    client = TestClient(app)
+    response = client.post("/analytics/query", json={"query_type": BIG_INT})
+    assert response.status_code == 200
+    assert response.json()["query_type"] == BIG_INT
@@ -0,0 +1,23 @@
+from fastapi.testclient import TestClient
+
+from app.main import app, _ROUTE_STATUS_TAGS, _ROUTE_TAGS
+
+
+def test_unknown_methods_share_the_other_tag(sent_metrics):
+    with TestClient(app) as client:
+        client.request('BREW', '/metrics/summary')
+        route_tags_size = len(_ROUTE_TAGS)
+        route_status_tags_size = len(_ROUTE_STATUS_TAGS)
+        
+        client.request('PURR', '/metrics/summary')
+        
+        # A new method token must not add cache entries
+        assert len(_ROUTE_TAGS) == route_tags_size
+        assert len(_ROUTE_STATUS_TAGS) == route_status_tags_size
+    
+    request_tags = [
+        tags for _, metric_name, _, tags, _ in sent_metrics
+        if metric_name == 'nexus.analytics.request.count'
+    ]
+    assert len(request_tags) == 2
+    assert all('method:OTHER' in tags for tags in request_tags)